@@ -12,16 +12,34 @@ Variáveis de ambiente:
     DB_PASSWORD          → admin password
 """
 
+import codecs
+import csv
+import functools
+import importlib.util
 import json
 import logging
 import os
-from datetime import datetime, timezone
-from io import BytesIO
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
 
 import azure.functions as func
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import pyodbc
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobSasPermissions, BlobServiceClient, generate_blob_sas
+from charset_normalizer import from_bytes
+
+# calamine (parser Rust para xlsx/xls) quando instalado; senão o pandas escolhe openpyxl/xlrd
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else None
 
 # ============================================================
 # CONFIG — mesmos nomes de variáveis do credito-app-brucken
@@ -36,17 +54,34 @@ DB_PASSWORD = os.environ.get('DB_PASSWORD', '')
 STAGING_CONTAINER = 'staging'
 REJECTED_CONTAINER = 'rejected'
 NOTIFICATIONS_CONTAINER = 'notifications'
-
-VALIDATION_RULES = {
-    'csv': {'max_rows': 10_000_000, 'max_columns': 500, 'encodings': ['utf-8', 'latin-1', 'iso-8859-1']},
-    'xlsx': {'max_rows': 1_048_576, 'max_columns': 500, 'max_sheets': 50},
-    'xls': {'max_rows': 1_048_576, 'max_columns': 500, 'max_sheets': 50},
-    'json': {'max_size_mb': 200},
-    'parquet': {'max_size_mb': 500},
-    'txt': {'max_size_mb': 100},
-}
-
-SQL_BATCH_SIZE = 1000
+COPY_POLL_SECONDS = 1
+COPY_TIMEOUT_SECONDS = 60  # cópia ainda pendente depois disso é abortada
+SPOOL_MAX_BYTES = 16 * 1024 * 1024  # acima disso o download vai para disco
+
+# Regras somente leitura — compartilhadas por todas as invocações do worker
+VALIDATION_RULES = MappingProxyType({
+    'csv': MappingProxyType({'max_rows': 10_000_000, 'max_columns': 500, 'encodings': ('utf-8', 'latin-1', 'iso-8859-1')}),
+    'xlsx': MappingProxyType({'max_rows': 1_048_576, 'max_columns': 500, 'max_sheets': 50}),
+    'xls': MappingProxyType({'max_rows': 1_048_576, 'max_columns': 500, 'max_sheets': 50}),
+    'json': MappingProxyType({'max_size_mb': 200}),
+    'parquet': MappingProxyType({'max_size_mb': 500}),
+    'txt': MappingProxyType({'max_size_mb': 100}),
+})
+
+CSV_SEPARATORS = [',', ';', '\t', '|']
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_BLOCK_SIZE = 8 << 20  # blocos de 8 MB para o parser paralelo do pyarrow
+CSV_SCHEMA_PROBE_SIZE = 256 << 10  # bloco lido só para inferir o schema
+
+TXT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# orjson já gera UTF-8 sem escapes e serializa os escalares numpy vindos do pandas
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+SQL_BATCH_SIZE = 10_000
+STAGING_INSERT_SQL = (
+    "INSERT INTO staging_data (upload_file_id, client_id, row_number, row_data) VALUES (?, ?, ?, ?)"
+)
 
 app = func.FunctionApp()
 
@@ -54,13 +89,31 @@ app = func.FunctionApp()
 # ============================================================
 # DATABASE — usa DB_SERVER, DB_NAME, DB_USER, DB_PASSWORD
 # ============================================================
+sql_local = threading.local()
+
+
 def get_sql_connection():
-    return pyodbc.connect(
+    """Conexão reaproveitada por thread — evita um handshake TLS com o Azure SQL por chamada."""
+    conn = getattr(sql_local, 'conn', None)
+    if conn is not None:
+        try:
+            conn.rollback()  # descarta transação deixada por uma chamada que falhou
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except pyodbc.Error:
+            logging.warning("Conexão SQL perdida — reconectando")
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+
+    sql_local.conn = pyodbc.connect(
         f"DRIVER={{ODBC Driver 18 for SQL Server}};"
         f"SERVER={DB_SERVER};DATABASE={DB_NAME};"
         f"UID={DB_USER};PWD={DB_PASSWORD};"
         f"Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;"
     )
+    return sql_local.conn
 
 
 def update_upload_status(blob_path, status, validation_result):
@@ -77,14 +130,13 @@ def update_upload_status(blob_path, status, validation_result):
             WHERE blob_path = ?""",
             (
                 status,
-                json.dumps(validation_result.get('errors', []), ensure_ascii=False),
-                json.dumps(validation_result.get('warnings', []), ensure_ascii=False),
-                json.dumps(validation_result.get('metadata', {}), ensure_ascii=False),
+                orjson.dumps(validation_result.get('errors', []), option=JSON_OPTIONS).decode(),
+                orjson.dumps(validation_result.get('warnings', []), option=JSON_OPTIONS).decode(),
+                orjson.dumps(validation_result.get('metadata', {}), option=JSON_OPTIONS).decode(),
                 blob_path
             )
         )
         conn.commit()
-        conn.close()
         logging.info(f"upload_files atualizado: {blob_path} → {status}")
     except Exception as e:
         logging.error(f"Erro ao atualizar upload_files: {e}")
@@ -96,7 +148,6 @@ def get_upload_file_id(blob_path):
         cursor = conn.cursor()
         cursor.execute("SELECT id, client_id FROM upload_files WHERE blob_path = ?", (blob_path,))
         row = cursor.fetchone()
-        conn.close()
         return (row[0], row[1]) if row else (None, None)
     except Exception as e:
         logging.error(f"Erro ao buscar upload_file_id: {e}")
@@ -107,28 +158,27 @@ def load_dataframe_to_staging(df, upload_file_id, client_id):
     try:
         conn = get_sql_connection()
         cursor = conn.cursor()
+        cursor.fast_executemany = True
+        # row_data é NVARCHAR(MAX): tipo fixo evita inferência e buffers por linha
+        cursor.setinputsizes([None, None, None, (pyodbc.SQL_WVARCHAR, 0, 0)])
 
         total_rows = 0
-        batch = []
-
-        for idx, row in df.iterrows():
-            row_data = row.to_json(force_ascii=False)
-            batch.append((upload_file_id, client_id, idx + 1, row_data))
-
-            if len(batch) >= SQL_BATCH_SIZE:
-                cursor.executemany(
-                    "INSERT INTO staging_data (upload_file_id, client_id, row_number, row_data) VALUES (?, ?, ?, ?)",
-                    batch
-                )
-                total_rows += len(batch)
-                batch = []
-
-        if batch:
-            cursor.executemany(
-                "INSERT INTO staging_data (upload_file_id, client_id, row_number, row_data) VALUES (?, ?, ?, ?)",
-                batch
-            )
-            total_rows += len(batch)
+
+        for start in range(0, len(df), SQL_BATCH_SIZE):
+            batch = df.iloc[start:start + SQL_BATCH_SIZE]
+            if batch.shape[1] == 0:
+                # Sem colunas (JSON [{}, {}]) o to_json não gera uma linha por registro
+                rows_json = ['{}'] * len(batch)
+            else:
+                # JSON por linha serializado em C, uma fatia do DataFrame por lote
+                rows_json = batch.to_json(
+                    orient='records', lines=True, force_ascii=False
+                ).rstrip('\n').split('\n')
+            cursor.executemany(STAGING_INSERT_SQL, [
+                (upload_file_id, client_id, start + i + 1, row_data)
+                for i, row_data in enumerate(rows_json)
+            ])
+            total_rows += len(rows_json)
 
         cursor.execute(
             """UPDATE upload_files SET
@@ -140,7 +190,6 @@ def load_dataframe_to_staging(df, upload_file_id, client_id):
         )
 
         conn.commit()
-        conn.close()
         logging.info(f"✓ {total_rows} linhas no staging_data (file_id={upload_file_id})")
         return total_rows
 
@@ -170,77 +219,107 @@ def process_uploaded_file(req: func.HttpRequest) -> func.HttpResponse:
     blob_name = f"uploads-clientes/{blob_path}"
     logging.info(f"[HTTP TRIGGER] Processando: {blob_name}")
 
-    # Baixa o conteúdo do blob
     try:
-        service = BlobServiceClient.from_connection_string(CONNECTION_STRING)
-        blob_client = service.get_container_client('uploads-clientes').get_blob_client(blob_path)
+        blob_client = get_container_client('uploads-clientes').get_blob_client(blob_path)
         blob_length = blob_client.get_blob_properties().size
-        content = blob_client.download_blob().readall()
     except Exception as e:
-        logging.error(f"Erro ao baixar blob {blob_name}: {e}")
+        logging.error(f"Erro ao acessar blob {blob_name}: {e}")
         return func.HttpResponse(f'Erro ao acessar blob: {str(e)}', status_code=500)
 
     parts = blob_path.split('/')
     filename = parts[-1] if parts else 'unknown'
-    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    _, dot, extension = filename.rpartition('.')
+    extension = extension.lower() if dot else ''
 
     upload_file_id, client_id = get_upload_file_id(blob_path)
 
+    now = datetime.now(timezone.utc)
     validation_result = {
         'blob_name': blob_name,
         'filename': filename,
         'extension': extension,
         'size_bytes': blob_length,
         'size_mb': round(blob_length / (1024 * 1024), 2),
-        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'timestamp': now.isoformat(),
         'valid': False,
         'errors': [],
         'warnings': [],
         'metadata': {}
     }
 
+    # Extensão e tamanho saem das propriedades do blob: arquivo rejeitado
+    # por eles vai para rejected sem ser baixado
+    rules = VALIDATION_RULES.get(extension)
+    stream = None
+    if rules is None:
+        validation_result['errors'].append(f'Extensão não suportada: .{extension}')
+    elif 'max_size_mb' in rules and blob_length > rules['max_size_mb'] * 1024 * 1024:
+        validation_result['errors'].append(
+            f'Excede {rules["max_size_mb"]}MB ({blob_length / (1024 * 1024):.1f}MB)'
+        )
+    else:
+        # Baixa o blob em partes para um arquivo temporário; só os primeiros
+        # SPOOL_MAX_BYTES ficam em memória
+        try:
+            stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+            blob_client.download_blob().readinto(stream)
+            stream.seek(0)
+        except Exception as e:
+            logging.error(f"Erro ao baixar blob {blob_name}: {e}")
+            return func.HttpResponse(f'Erro ao acessar blob: {str(e)}', status_code=500)
+
     try:
         df = None
 
-        if extension == 'csv':
-            validation_result, df = validate_csv(content, validation_result)
-        elif extension in ('xlsx', 'xls'):
-            validation_result, df = validate_excel(content, validation_result)
-        elif extension == 'json':
-            validation_result, df = validate_json(content, validation_result)
-        elif extension == 'parquet':
-            validation_result, df = validate_parquet(content, validation_result)
-        elif extension == 'txt':
-            validation_result['metadata'] = validate_txt(content)
-        else:
-            validation_result['errors'].append(f'Extensão não suportada: .{extension}')
-
-        if not validation_result['errors']:
-            validation_result['valid'] = True
-            move_blob(content, blob_name, STAGING_CONTAINER)
-            update_upload_status(blob_path, 'staged', validation_result)
-
-            if df is not None and upload_file_id:
-                rows = load_dataframe_to_staging(df, upload_file_id, client_id)
-                logging.info(f"[OK] {blob_name} → staging + {rows} linhas no db_credito")
+        # A cópia para staging/rejected é server-side: o arquivo temporário é
+        # descartado antes da carga do DataFrame no SQL
+        if stream is not None:
+            with stream:
+                if extension == 'csv':
+                    validation_result, df = validate_csv(stream, validation_result)
+                elif extension in ('xlsx', 'xls'):
+                    validation_result, df = validate_excel(stream, validation_result)
+                elif extension == 'json':
+                    validation_result, df = validate_json(stream, validation_result)
+                elif extension == 'parquet':
+                    validation_result, df = validate_parquet(stream, validation_result)
+                elif extension == 'txt':
+                    validation_result['metadata'] = validate_txt(stream)
+
+        validation_result['valid'] = not validation_result['errors']
+        dest_container = STAGING_CONTAINER if validation_result['valid'] else REJECTED_CONTAINER
+
+        # Mover o blob e gravar o relatório não dependem um do outro nem do SQL:
+        # as chamadas ao storage correm em paralelo com a atualização e a carga
+        blob_ops = [
+            blob_executor.submit(move_blob, blob_name, dest_container),
+            blob_executor.submit(save_notification, validation_result, now),
+        ]
+        try:
+            if validation_result['valid']:
+                update_upload_status(blob_path, 'staged', validation_result)
+
+                if df is not None and upload_file_id:
+                    rows = load_dataframe_to_staging(df, upload_file_id, client_id)
+                    logging.info(f"[OK] {blob_name} → staging + {rows} linhas no db_credito")
+                else:
+                    logging.info(f"[OK] {blob_name} → staging")
             else:
-                logging.info(f"[OK] {blob_name} → staging")
-        else:
-            move_blob(content, blob_name, REJECTED_CONTAINER)
-            update_upload_status(blob_path, 'rejected', validation_result)
-            logging.warning(f"[REJEITADO] {blob_name}: {validation_result['errors']}")
-
-        save_notification(validation_result)
+                update_upload_status(blob_path, 'rejected', validation_result)
+                logging.warning(f"[REJEITADO] {blob_name}: {validation_result['errors']}")
+        finally:
+            for op in blob_ops:
+                op.result()
 
     except Exception as e:
         logging.error(f"[ERRO] {blob_name}: {str(e)}")
         validation_result['errors'].append(f'Erro interno: {str(e)}')
         update_upload_status(blob_path, 'error', validation_result)
-        save_notification(validation_result)
+        save_notification(validation_result, now)
 
     status_code = 200 if validation_result['valid'] else 422
     return func.HttpResponse(
-        json.dumps(validation_result, ensure_ascii=False),
+        orjson.dumps(validation_result, option=JSON_OPTIONS),
         status_code=status_code,
         mimetype='application/json'
     )
@@ -249,56 +328,135 @@ def process_uploaded_file(req: func.HttpRequest) -> func.HttpResponse:
 # ============================================================
 # VALIDATORS
 # ============================================================
-def validate_csv(content, result):
+def detect_csv_separator(sample):
+    """Primeiro separador que divide o cabeçalho em mais de uma coluna."""
+    header = sample.split('\n', 1)[0]
+    for sep in CSV_SEPARATORS:
+        if len(next(csv.reader([header], delimiter=sep))) > 1:
+            return sep
+    return None
+
+
+def read_csv_table(stream, encoding, sep):
+    """Parse multithread do pyarrow; datas ficam como texto, como no pd.read_csv."""
+    read_options = pacsv.ReadOptions(encoding=encoding, block_size=CSV_BLOCK_SIZE)
+    parse_options = pacsv.ParseOptions(delimiter=sep, newlines_in_values=True)
+
+    def parse(column_types):
+        stream.seek(0)
+        return pacsv.read_csv(
+            stream, read_options=read_options, parse_options=parse_options,
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True, column_types=column_types)
+        )
+
+    stream.seek(0)
+    try:
+        # Converter data/hora de volta para texto não devolve o original (10:30 → 10:30:00):
+        # o schema do primeiro bloco indica as colunas temporais, lidas direto como string
+        schema = pacsv.open_csv(
+            stream,
+            read_options=pacsv.ReadOptions(encoding=encoding, block_size=CSV_SCHEMA_PROBE_SIZE),
+            parse_options=parse_options,
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+        ).schema
+        text_columns = {field.name: pa.string() for field in schema if pa.types.is_temporal(field.type)}
+        table = parse(text_columns)
+
+        # Coluna toda nula no primeiro bloco ainda pode ter sido inferida como data/hora
+        late = {field.name: pa.string() for field in table.schema if pa.types.is_temporal(field.type)}
+        if late:
+            table = parse({**text_columns, **late})
+    except pa.ArrowInvalid:
+        # pyarrow rejeita linhas com menos campos que o cabeçalho; o pandas completa com nulos
+        stream.seek(0)
+        df = pd.read_csv(stream, encoding=encoding, sep=sep, low_memory=False)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    for field in table.schema:
+        if pa.types.is_binary(field.type):
+            raise pa.ArrowInvalid(f'Coluna {field.name} não decodificável como {encoding}')
+    return table
+
+
+def dedupe_column_names(names):
+    """Renomeia duplicadas como o pandas (col, col.1, col.2...)."""
+    seen = {}
+    unique = []
+    for name in names:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        unique.append(f'{name}.{count}' if count else name)
+    return unique
+
+
+def validate_csv(stream, result):
     rules = VALIDATION_RULES['csv']
-    df = None
+    table = None
 
-    for enc in rules['encodings']:
-        for sep in [',', ';', '\t', '|']:
-            try:
-                df = pd.read_csv(BytesIO(content), encoding=enc, sep=sep, low_memory=False)
-                if len(df.columns) > 1:
-                    result['metadata']['encoding'] = enc
-                    result['metadata']['separator'] = sep
-                    break
-                df = None
-            except (UnicodeDecodeError, pd.errors.ParserError):
+    # Detecta o encoding uma vez na amostra; os demais encodings da regra ficam como fallback
+    sample = stream.read(CSV_SNIFF_BYTES)
+    best = from_bytes(sample, cp_isolation=rules['encodings']).best()
+    detected = codecs.lookup(best.encoding).name if best else None
+    encodings = sorted(rules['encodings'], key=lambda enc: codecs.lookup(enc).name != detected)
+
+    for enc in encodings:
+        try:
+            sep = detect_csv_separator(sample.decode(enc, errors='ignore'))
+            if sep is None:
                 continue
-        if df is not None:
+            table = read_csv_table(stream, enc, sep)
+            result['metadata']['encoding'] = enc
+            result['metadata']['separator'] = sep
             break
+        except (UnicodeDecodeError, LookupError, pa.ArrowInvalid, pd.errors.ParserError):
+            continue
 
-    if df is None:
+    if table is None:
         result['errors'].append('CSV ilegível com encodings UTF-8/Latin-1')
         return result, None
 
-    rows, cols = df.shape
+    # Cabeçalho vazio vira "Unnamed: N", como no pandas — não entra no aviso de duplicadas
+    names = [name or f'Unnamed: {i}' for i, name in enumerate(table.column_names)]
+    if names != table.column_names:
+        table = table.rename_columns(names)
+
+    dup_cols = [name for i, name in enumerate(table.column_names) if name in table.column_names[:i]]
+    if dup_cols:
+        result['warnings'].append(f'Colunas duplicadas: {dup_cols[:5]}')
+        table = table.rename_columns(dedupe_column_names(table.column_names))
+
+    rows, cols = table.num_rows, table.num_columns
     if rows > rules['max_rows']:
         result['errors'].append(f'Excede {rules["max_rows"]:,} linhas ({rows:,})')
     if cols > rules['max_columns']:
         result['errors'].append(f'Excede {rules["max_columns"]} colunas ({cols})')
 
-    dup_cols = df.columns[df.columns.duplicated()].tolist()
-    if dup_cols:
-        result['warnings'].append(f'Colunas duplicadas: {dup_cols[:5]}')
-
-    empty = df.isnull().all(axis=1).sum()
+    # Nulos contados nos buffers Arrow: null_count já vem do parse, sem máscara por célula.
+    # Só há linha vazia se todas as colunas tiverem algum nulo.
+    null_counts = [column.null_count for column in table.columns]
+    empty = 0
+    if all(null_counts):
+        empty = pc.sum(functools.reduce(pc.and_, map(pc.is_null, table.columns))).as_py()
     if empty > 0:
         result['warnings'].append(f'{empty} linhas vazias')
 
     result['metadata'].update({
         'rows': rows, 'columns': cols,
-        'column_names': df.columns.tolist()[:50],
-        'null_pct': round(df.isnull().mean().mean() * 100, 2)
+        'column_names': table.column_names[:50],
+        'null_pct': round(sum(null_counts) / (rows * cols) * 100, 2) if rows else 0.0
     })
 
-    return result, df
+    if result['errors']:
+        return result, None
+
+    return result, table.to_pandas()
 
 
-def validate_excel(content, result):
+def validate_excel(stream, result):
     rules = VALIDATION_RULES['xlsx']
 
     try:
-        xls = pd.ExcelFile(BytesIO(content))
+        xls = pd.ExcelFile(stream, engine=EXCEL_ENGINE)
     except Exception as e:
         result['errors'].append(f'Excel corrompido: {str(e)}')
         return result, None
@@ -308,13 +466,25 @@ def validate_excel(content, result):
         result['errors'].append(f'Excede {rules["max_sheets"]} abas ({len(sheets)})')
         return result, None
 
-    try:
-        df = pd.read_excel(xls, sheet_name=0)
-    except Exception as e:
-        result['errors'].append(f'Erro ao ler primeira aba: {str(e)}')
-        return result, None
+    df = None
+    if EXCEL_ENGINE:
+        # Dimensões da primeira aba vêm do range do calamine (linha 0 = cabeçalho);
+        # abas acima do limite são rejeitadas sem montar DataFrame
+        sheet = xls.book.get_sheet_by_index(0)
+        rows, cols = (sheet.end[0], sheet.end[1] + 1) if sheet.end else (0, 0)
+        header = sheet.to_python(nrows=1)
+        column_names = header[0][:50] if header else []
+        fits = rows <= rules['max_rows'] and cols <= rules['max_columns']
+
+    if not EXCEL_ENGINE or fits:
+        try:
+            df = pd.read_excel(xls, sheet_name=0)
+        except Exception as e:
+            result['errors'].append(f'Erro ao ler primeira aba: {str(e)}')
+            return result, None
+        rows, cols = df.shape
+        column_names = df.columns.tolist()[:50]
 
-    rows, cols = df.shape
     if rows > rules['max_rows']:
         result['errors'].append(f'Excede {rules["max_rows"]:,} linhas ({rows:,})')
     if cols > rules['max_columns']:
@@ -323,20 +493,14 @@ def validate_excel(content, result):
     result['metadata'] = {
         'sheet_count': len(sheets), 'sheet_names': sheets,
         'rows': rows, 'columns': cols,
-        'column_names': df.columns.tolist()[:50]
+        'column_names': column_names
     }
 
     return result, df
 
 
-def validate_json(content, result):
-    rules = VALIDATION_RULES['json']
-    size_mb = len(content) / (1024 * 1024)
-
-    if size_mb > rules['max_size_mb']:
-        result['errors'].append(f'Excede {rules["max_size_mb"]}MB ({size_mb:.1f}MB)')
-        return result, None
-
+def validate_json(stream, result):
+    content = stream.read()
     try:
         data = json.loads(content.decode('utf-8'))
     except UnicodeDecodeError:
@@ -355,77 +519,145 @@ def validate_json(content, result):
     return result, df
 
 
-def validate_parquet(content, result):
-    rules = VALIDATION_RULES['parquet']
-    size_mb = len(content) / (1024 * 1024)
-
-    if size_mb > rules['max_size_mb']:
-        result['errors'].append(f'Excede {rules["max_size_mb"]}MB ({size_mb:.1f}MB)')
-        return result, None
-
+def validate_parquet(stream, result):
     try:
-        df = pd.read_parquet(BytesIO(content))
-        rows, cols = df.shape
+        # Linhas, colunas e schema vêm do footer — nenhuma coluna é decodificada para validar
+        pf = pq.ParquetFile(stream)
+        schema = pf.schema_arrow
+        # Índice gravado pelo pandas aparece como coluna física; não conta como dado
+        index_cols = {c for c in (schema.pandas_metadata or {}).get('index_columns', []) if isinstance(c, str)}
+        fields = [field for field in schema if field.name not in index_cols]
         result['metadata'] = {
-            'rows': rows, 'columns': cols,
-            'column_names': df.columns.tolist()[:50]
+            'rows': pf.metadata.num_rows, 'columns': len(fields),
+            'column_names': [field.name for field in fields[:50]],
+            'dtypes': {field.name: str(field.type) for field in fields}
         }
-        return result, df
+        return result, pf.read().to_pandas()
     except Exception as e:
         result['errors'].append(f'Parquet inválido: {str(e)}')
         return result, None
 
 
-def validate_txt(content):
-    try:
-        text = content.decode('utf-8')
-    except UnicodeDecodeError:
-        text = content.decode('latin-1')
-    return {'lines': text.count('\n') + 1, 'characters': len(text)}
+def validate_txt(stream):
+    """Conta linhas e caracteres em blocos, sem montar o texto inteiro em memória."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    lines, size, utf8_chars = 1, 0, 0
+
+    chunk = stream.read(TXT_CHUNK_SIZE)
+    while chunk:
+        lines += chunk.count(b'\n')
+        size += len(chunk)
+        if decoder is not None:
+            try:
+                utf8_chars += len(decoder.decode(chunk))
+            except UnicodeDecodeError:
+                decoder = None  # não é UTF-8: latin-1, um byte por caractere
+        chunk = stream.read(TXT_CHUNK_SIZE)
+
+    if decoder is not None:
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            decoder = None  # sequência multibyte cortada no fim do arquivo
+    return {'lines': lines, 'characters': utf8_chars if decoder is not None else size}
 
 
 # ============================================================
 # BLOB OPERATIONS
 # ============================================================
-def move_blob(content, original_path, dest_container):
-    if not CONNECTION_STRING:
-        logging.info(f"[DEMO] Move {original_path} → {dest_container}")
-        return
+blob_service_client = None
+container_clients = {}
+blob_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='blob-ops')
 
-    try:
-        service = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+
+def get_blob_service():
+    global blob_service_client
+    if blob_service_client is None:
+        blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    return blob_service_client
+
+
+def get_container_client(name):
+    """ContainerClient reaproveitado entre invocações; o container é criado uma única vez."""
+    container_client = container_clients.get(name)
+    if container_client is None:
+        container_client = get_blob_service().get_container_client(name)
         try:
-            service.create_container(dest_container)
-        except Exception:
+            container_client.create_container()
+        except ResourceExistsError:
             pass
+        container_clients[name] = container_client
+    return container_client
+
+
+def copy_source_url(blob_client):
+    """URL da origem com SAS de leitura de curta duração; None sem account key."""
+    account_key = getattr(blob_client.credential, 'account_key', None)
+    if not account_key:
+        return None
+    sas = generate_blob_sas(
+        account_name=blob_client.account_name,
+        container_name=blob_client.container_name,
+        blob_name=blob_client.blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(minutes=15)
+    )
+    return f"{blob_client.url}?{sas}"
+
 
-        dest_name = original_path.replace('uploads-clientes/', '')
-        blob_client = service.get_container_client(dest_container).get_blob_client(dest_name)
-        blob_client.upload_blob(content, overwrite=True)
+def move_blob(original_path, dest_container):
+    if not CONNECTION_STRING:
+        logging.info(f"[DEMO] Move {original_path} → {dest_container}")
+        return
 
+    try:
         orig_name = original_path.replace('uploads-clientes/', '')
-        service.get_container_client('uploads-clientes').get_blob_client(orig_name).delete_blob()
+        dest_name = orig_name
+        source_client = get_container_client('uploads-clientes').get_blob_client(orig_name)
+        blob_client = get_container_client(dest_container).get_blob_client(dest_name)
+
+        source_url = copy_source_url(source_client)
+        if source_url is None:
+            # Sem account key não há SAS, e o container privado recusaria a cópia
+            # server-side (403): os bytes passam pela Function, em streaming
+            logging.warning(f"Credencial sem account key — {orig_name} movido por download/upload")
+            downloader = source_client.download_blob()
+            blob_client.upload_blob(
+                downloader, length=downloader.size, overwrite=True,
+                metadata=downloader.properties.metadata,
+                content_settings=downloader.properties.content_settings
+            )
+        else:
+            # Cópia server-side na mesma conta — os bytes não passam pela Function
+            copy = blob_client.start_copy_from_url(source_url)
+            status = copy['copy_status']
+            deadline = time.monotonic() + COPY_TIMEOUT_SECONDS
+            while status == 'pending':
+                if time.monotonic() > deadline:
+                    blob_client.abort_copy(copy['copy_id'])
+                    raise RuntimeError(f"cópia pendente por mais de {COPY_TIMEOUT_SECONDS}s, abortada")
+                time.sleep(COPY_POLL_SECONDS)
+                status = blob_client.get_blob_properties().copy.status
+            if status != 'success':
+                raise RuntimeError(f"cópia terminou com status {status}")
+
+        source_client.delete_blob()
 
         logging.info(f"Movido: uploads-clientes/{orig_name} → {dest_container}/{dest_name}")
     except Exception as e:
         logging.error(f"Erro ao mover blob: {e}")
 
 
-def save_notification(result):
+def save_notification(result, now=None):
     if not CONNECTION_STRING:
         return
     try:
-        service = BlobServiceClient.from_connection_string(CONNECTION_STRING)
-        try:
-            service.create_container(NOTIFICATIONS_CONTAINER)
-        except Exception:
-            pass
-
-        now = datetime.now(timezone.utc)
+        now = now or datetime.now(timezone.utc)
         report_name = f"{now.strftime('%Y/%m/%d')}/{result['filename']}_report.json"
-        blob_client = service.get_container_client(NOTIFICATIONS_CONTAINER).get_blob_client(report_name)
+        blob_client = get_container_client(NOTIFICATIONS_CONTAINER).get_blob_client(report_name)
         blob_client.upload_blob(
-            json.dumps(result, indent=2, ensure_ascii=False).encode('utf-8'),
+            orjson.dumps(result, option=JSON_OPTIONS | orjson.OPT_INDENT_2),
             overwrite=True
         )
     except Exception as e:
@@ -16,20 +16,32 @@ Variáveis NOVAS (adicionar):
     AZURE_STORAGE_CONNECTION_STRING  → connection string do bruckencredito
     AZURE_STORAGE_CONTAINER          → uploads-clientes
     ALLOWED_ORIGINS                  → https://credito-app-brucken.azurewebsites.net
+    AZURE_UPLOAD_CONCURRENCY         → blocos enviados em paralelo por upload (opcional, 8)
+    AZURE_BLOCK_SIZE                 → tamanho do bloco em bytes (opcional, 8 MB)
 """
 
 import os
-import uuid
+import queue
+import secrets
 import hashlib
+import hmac
 import json
 import threading
-from datetime import datetime, timezone
-from io import BytesIO
-
+import time
+from collections import defaultdict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from types import MappingProxyType
+
+import orjson
 import requests as http_requests
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, abort, request, jsonify, send_from_directory
 from flask_cors import CORS
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from werkzeug.http import http_date
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient, BlobType, ContentSettings
+from blake3 import blake3
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -38,7 +50,10 @@ load_dotenv()
 # CONFIG — usa nomes de variáveis JÁ EXISTENTES no App Service
 # ============================================================
 app = Flask(__name__)
-CORS(app, origins=os.getenv('ALLOWED_ORIGINS', '*').split(','))
+
+# Preflight em cache no navegador por 24h — evita um OPTIONS antes de cada upload
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv('ALLOWED_ORIGINS', '*').split(',') if o.strip()]
+CORS(app, origins=ALLOWED_ORIGINS or '*', max_age=86400, expose_headers=['X-Next-Before'])
 
 # Storage (NOVA)
 AZURE_CONNECTION_STRING = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
@@ -57,17 +72,64 @@ API_SECRET_KEY = os.getenv('JWT_SECRET', 'dev-secret-key')
 FUNCTION_URL = os.getenv('FUNCTION_URL', '')  # https://func-brucken-upload.azurewebsites.net/api/process
 PROCESS_SECRET = os.getenv('PROCESS_SECRET', '')
 
-ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls', 'json', 'txt', 'parquet'}
+ALLOWED_EXTENSIONS = frozenset({'csv', 'xlsx', 'xls', 'json', 'txt', 'parquet'})
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
 
+# Werkzeug rejeita corpos maiores antes de ler/spoolar qualquer byte
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+
+# Upload em blocos paralelos para arquivos grandes (ajustáveis por ambiente)
+BLOB_MAX_CONCURRENCY = int(os.getenv('AZURE_UPLOAD_CONCURRENCY', '8'))
+BLOB_BLOCK_SIZE = int(os.getenv('AZURE_BLOCK_SIZE', str(8 * 1024 * 1024)))  # 8 MB
+MAX_CONCURRENT_UPLOADS = 16  # transferências simultâneas por processo
+HASH_CHUNK_SIZE = 4 * 1024 * 1024  # leitura em blocos para o hash do conteúdo
+
+CONTENT_TYPES = MappingProxyType({
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'txt': 'text/plain',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'xls': 'application/vnd.ms-excel',
+    'parquet': 'application/octet-stream'
+})
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+HISTORY_LIMIT = 50  # máximo de linhas por página de /api/history
+
+# Clientes lidos do db_credito ficam em memória por pouco tempo — evita um
+# round-trip ao SQL a cada autenticação/upload do mesmo cliente
+CLIENT_CACHE_TTL = 60  # segundos
+CLIENT_CACHE_MAX = 1024
+client_cache = {}
+
 
 # ============================================================
 # DATABASE CONNECTION — usa DB_SERVER, DB_NAME, DB_USER, DB_PASSWORD
 # ============================================================
+# Conexões devolvidas ficam abertas para a próxima requisição: o handshake
+# TLS/login no Azure SQL custa mais que as queries do portal
+DB_POOL_SIZE = 10
+db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+
 def get_db_connection():
-    """Conecta ao db_credito via variáveis existentes."""
+    """Conexão do pool (testada com SELECT 1) ou nova conexão ao db_credito."""
+    while True:
+        try:
+            conn = db_pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
     try:
         import pyodbc
+        pyodbc.pooling = False  # o pool é este; sem o pooling do driver manager
         conn_str = (
             f"DRIVER={{ODBC Driver 18 for SQL Server}};"
             f"SERVER={DB_SERVER};"
@@ -87,6 +149,18 @@ def get_db_connection():
         return None
 
 
+def release_db_connection(conn):
+    """Devolve a conexão ao pool; fecha se estiver quebrada ou o pool cheio."""
+    try:
+        conn.rollback()
+        db_pool.put_nowait(conn)
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
 def query_db(sql, params=None, fetchone=False, commit=False):
     """Executa query no db_credito."""
     conn = get_db_connection()
@@ -101,13 +175,10 @@ def query_db(sql, params=None, fetchone=False, commit=False):
             cursor.execute(sql)
 
         if commit:
+            # INSERT ... OUTPUT INSERTED.id devolve o id no mesmo round-trip
+            row = cursor.fetchone() if cursor.description else None
             conn.commit()
-            try:
-                cursor.execute("SELECT SCOPE_IDENTITY()")
-                row = cursor.fetchone()
-                return row[0] if row else None
-            except Exception:
-                return None
+            return row[0] if row else None
 
         if fetchone:
             row = cursor.fetchone()
@@ -122,7 +193,7 @@ def query_db(sql, params=None, fetchone=False, commit=False):
         app.logger.error(f"Erro SQL: {e}")
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 # ============================================================
@@ -130,85 +201,154 @@ def query_db(sql, params=None, fetchone=False, commit=False):
 # ============================================================
 DEMO_CLIENTS = {
     'CLI-00123': {
-        'token_hash': hashlib.sha256('token-secreto-123'.encode()).hexdigest(),
+        'token_hash': hashlib.sha256('token-secreto-123'.encode()).digest(),
         'name': 'Empresa Demo LTDA',
         'container_prefix': 'cli-00123'
     },
     'CLI-00456': {
-        'token_hash': hashlib.sha256('token-secreto-456'.encode()).hexdigest(),
+        'token_hash': hashlib.sha256('token-secreto-456'.encode()).digest(),
         'name': 'Financeira ABC S.A.',
         'container_prefix': 'cli-00456'
     }
 }
 
-demo_upload_history = {}
+# Últimos uploads por cliente (modo demo) — deque limita o crescimento em memória
+DEMO_HISTORY_LIMIT = 100
+demo_upload_history = defaultdict(lambda: deque(maxlen=DEMO_HISTORY_LIMIT))
 
 
 # ============================================================
 # AZURE BLOB SERVICE — bruckencredito
 # ============================================================
 blob_service_client = None
+container_client = None
+blob_init_lock = threading.Lock()
+upload_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS, thread_name_prefix='blob-upload')
 
 
 def get_blob_service():
-    global blob_service_client
+    global blob_service_client, container_client
     if blob_service_client is None and AZURE_CONNECTION_STRING:
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONNECTION_STRING)
-        try:
-            blob_service_client.create_container(AZURE_CONTAINER)
-        except Exception:
-            pass
+        # Threads do upload_executor chegam juntas: só uma inicializa, e os dois
+        # clientes são publicados juntos depois que o container existe
+        with blob_init_lock:
+            if blob_service_client is None:
+                service = BlobServiceClient.from_connection_string(
+                    AZURE_CONNECTION_STRING,
+                    max_block_size=BLOB_BLOCK_SIZE,
+                    max_single_put_size=BLOB_BLOCK_SIZE
+                )
+                container = service.get_container_client(AZURE_CONTAINER)
+                # Uma chamada só: criar e tratar "já existe" dispensa o exists() antes
+                try:
+                    container.create_container()
+                except ResourceExistsError:
+                    pass
+                except Exception as e:
+                    app.logger.warning(f"Erro ao verificar container {AZURE_CONTAINER}: {e}")
+                container_client = container
+                blob_service_client = service
     return blob_service_client
 
 
-def upload_to_blob(file_stream, blob_name, content_type='application/octet-stream'):
+def upload_to_blob(file_stream, blob_name, content_type=DEFAULT_CONTENT_TYPE, length=None, uploaded_at=None):
     """Upload para bruckencredito/uploads-clientes."""
-    service = get_blob_service()
-    if service is None:
+    if get_blob_service() is None:
         return {
             'blob_name': blob_name,
             'url': f'https://bruckencredito.blob.core.windows.net/{AZURE_CONTAINER}/{blob_name}',
-            'size': 0,
+            'size': length or 0,
             'demo': True
         }
 
-    container_client = service.get_container_client(AZURE_CONTAINER)
     blob_client = container_client.get_blob_client(blob_name)
+    content_hash = stream_blake3(file_stream)
 
     content_settings = ContentSettings(content_type=content_type)
     blob_client.upload_blob(
         file_stream,
+        length=length,
+        blob_type=BlobType.BLOCKBLOB,
         overwrite=True,
         content_settings=content_settings,
+        max_concurrency=BLOB_MAX_CONCURRENCY,
         metadata={
-            'uploaded_at': datetime.now(timezone.utc).isoformat(),
-            'original_name': blob_name.split('/')[-1]
+            'uploaded_at': (uploaded_at or datetime.now(timezone.utc)).isoformat(),
+            'original_name': blob_name.split('/')[-1],
+            'content_blake3': content_hash
         }
     )
 
     return {
         'blob_name': blob_name,
         'url': blob_client.url,
-        'size': blob_client.get_blob_properties().size
+        'size': length,
+        'content_blake3': content_hash
     }
 
 
 # ============================================================
 # HELPERS
 # ============================================================
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def stream_size(stream):
+    """Tamanho do stream sem ler o conteúdo (o Werkzeug já spoolou o upload em disco)."""
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
 
 
-def generate_blob_path(client_prefix, original_filename):
-    now = datetime.now(timezone.utc)
-    unique_id = uuid.uuid4().hex[:8]
+def stream_blake3(stream):
+    """Hash BLAKE3 (multithread) do stream, lido em blocos e rebobinado ao final."""
+    position = stream.tell()
+    hasher = blake3(max_threads=blake3.AUTO)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    stream.seek(position)
+    return hasher.hexdigest()
+
+
+def allowed_file(ext):
+    return ext in ALLOWED_EXTENSIONS
+
+
+def json_default(obj):
+    """Mesmo formato do jsonify: datas como HTTP-date, Decimal e demais tipos como texto."""
+    if isinstance(obj, date):
+        return http_date(obj)
+    return str(obj)
+
+
+def json_response(data):
+    """JSON via orjson para as listas de histórico/dashboard."""
+    return app.response_class(
+        orjson.dumps(data, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME),
+        mimetype='application/json'
+    )
+
+
+def format_file_size(size_bytes):
+    if size_bytes is None:
+        return None
+    if size_bytes >= 1048576:
+        return f"{size_bytes / 1048576:.1f} MB"
+    return f"{size_bytes / 1024:.1f} KB"
+
+
+def generate_blob_path(client_prefix, original_filename, now=None):
+    now = now or datetime.now(timezone.utc)
+    unique_id = secrets.token_hex(4)
     safe_name = original_filename.replace(' ', '_')
     return f"{client_prefix}/{now.year}/{now.month:02d}/{now.day:02d}/{unique_id}_{safe_name}"
 
 
 def get_client(client_id):
-    """Busca cliente no db_credito. Fallback para modo demo."""
+    """Busca cliente no db_credito (cache de CLIENT_CACHE_TTL s). Fallback para modo demo."""
+    now = time.monotonic()
+    cached = client_cache.get(client_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
     result = query_db(
         "SELECT client_id, client_name, token_hash, container_prefix, is_active "
         "FROM upload_clients WHERE client_id = ? AND is_active = 1",
@@ -217,13 +357,25 @@ def get_client(client_id):
     )
 
     if result:
-        return {
-            'token_hash': result['token_hash'],
+        try:
+            token_hash = bytes.fromhex(result['token_hash'])
+        except (TypeError, ValueError):
+            app.logger.error(f"token_hash inválido em upload_clients para {client_id}")
+            return None
+        client = {
+            'token_hash': token_hash,
             'name': result['client_name'],
             'container_prefix': result['container_prefix']
         }
+    else:
+        client = DEMO_CLIENTS.get(client_id)
 
-    return DEMO_CLIENTS.get(client_id)
+    # Só clientes encontrados entram no cache: um cliente recém-cadastrado não espera o TTL
+    if client:
+        if len(client_cache) >= CLIENT_CACHE_MAX:
+            client_cache.clear()
+        client_cache[client_id] = (now + CLIENT_CACHE_TTL, client)
+    return client
 
 
 def trigger_processing(blob_path):
@@ -248,6 +400,7 @@ def register_upload_in_db(client_id, filename, blob_path, extension, size_bytes)
     file_id = query_db(
         """INSERT INTO upload_files
            (client_id, original_filename, blob_path, file_extension, file_size_bytes, upload_status)
+           OUTPUT INSERTED.id
            VALUES (?, ?, ?, ?, ?, 'uploaded')""",
         (client_id, filename, blob_path, extension, size_bytes),
         commit=True
@@ -259,6 +412,11 @@ def register_upload_in_db(client_id, filename, blob_path, extension, size_bytes)
 # ROUTES
 # ============================================================
 
+@app.errorhandler(413)
+def file_too_large(e):
+    return jsonify({'error': f'Arquivo excede o limite de {MAX_FILE_SIZE // (1024*1024)}MB'}), 413
+
+
 @app.route('/')
 def serve_frontend():
     # Em dev: ../frontend | Em deploy: ./frontend (mesma pasta)
@@ -281,7 +439,7 @@ def health():
         except Exception:
             pass
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     return jsonify({
         'status': 'ok',
@@ -311,8 +469,8 @@ def authenticate():
     if not client:
         return jsonify({'error': 'Cliente não encontrado'}), 401
 
-    token_hash = hashlib.sha256(access_token.encode()).hexdigest()
-    if token_hash != client['token_hash']:
+    token_hash = hashlib.sha256(access_token.encode()).digest()
+    if not hmac.compare_digest(token_hash, client['token_hash']):
         return jsonify({'error': 'Token inválido'}), 401
 
     return jsonify({
@@ -325,6 +483,9 @@ def authenticate():
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Recebe arquivo → bruckencredito/uploads-clientes → registra em db_credito."""
+    if request.content_length and request.content_length > MAX_FILE_SIZE:
+        abort(413)
+
     if 'file' not in request.files:
         return jsonify({'error': 'Nenhum arquivo enviado'}), 400
 
@@ -338,36 +499,37 @@ def upload_file():
     if not client:
         return jsonify({'error': 'Cliente não autorizado'}), 401
 
-    if not allowed_file(file.filename):
-        ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else 'N/A'
-        return jsonify({'error': f'Extensão .{ext} não permitida'}), 400
-
-    file_content = file.read()
-    if len(file_content) > MAX_FILE_SIZE:
-        return jsonify({'error': f'Arquivo excede o limite de {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
-
-    blob_path = generate_blob_path(client['container_prefix'], file.filename)
-    ext = file.filename.rsplit('.', 1)[1].lower()
+    _, dot, ext = file.filename.rpartition('.')
+    ext = ext.lower() if dot else ''
+    if not allowed_file(ext):
+        return jsonify({'error': f'Extensão .{ext or "N/A"} não permitida'}), 400
 
-    content_types = {
-        'csv': 'text/csv',
-        'json': 'application/json',
-        'txt': 'text/plain',
-        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'xls': 'application/vnd.ms-excel',
-        'parquet': 'application/octet-stream'
-    }
+    file_size = stream_size(file.stream)
+    now = datetime.now(timezone.utc)
+    blob_path = generate_blob_path(client['container_prefix'], file.filename, now)
 
     try:
-        result = upload_to_blob(
-            BytesIO(file_content),
+        # Pool compartilhado limita as transferências simultâneas para o Storage
+        future = upload_executor.submit(
+            upload_to_blob,
+            file.stream,
             blob_path,
-            content_types.get(ext, 'application/octet-stream')
+            CONTENT_TYPES.get(ext, DEFAULT_CONTENT_TYPE),
+            length=file_size,
+            uploaded_at=now
         )
+        result = future.result()
 
         file_id = register_upload_in_db(
-            client_id, file.filename, blob_path, ext, len(file_content)
+            client_id, file.filename, blob_path, ext, file_size
         )
+        if file_id is None:
+            demo_upload_history[client_id].appendleft({
+                'name': file.filename,
+                'size': format_file_size(file_size),
+                'date': now.strftime('%d/%m/%Y %H:%M'),
+                'status': 'uploaded'
+            })
 
         # Dispara processamento em background (não bloqueia a resposta)
         t = threading.Thread(target=trigger_processing, args=(blob_path,), daemon=True)
@@ -378,7 +540,8 @@ def upload_file():
             'file_id': file_id,
             'blob_path': blob_path,
             'file_name': file.filename,
-            'file_size': len(file_content),
+            'file_size': file_size,
+            'content_blake3': result.get('content_blake3'),
             'message': 'Arquivo enviado. Processamento iniciado.'
         })
 
@@ -388,31 +551,44 @@ def upload_file():
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Retorna histórico de uploads do db_credito."""
+    """Retorna histórico de uploads do db_credito, paginado por ?limit= e ?before=."""
     client_id = request.args.get('client_id', '').strip()
     if not client_id:
         return jsonify({'error': 'client_id é obrigatório'}), 400
 
-    history = query_db(
-        """SELECT TOP 50
-               original_filename AS name,
-               CASE
-                   WHEN file_size_bytes >= 1048576
-                   THEN CAST(CAST(file_size_bytes / 1048576.0 AS DECIMAL(10,1)) AS VARCHAR) + ' MB'
-                   ELSE CAST(CAST(file_size_bytes / 1024.0 AS DECIMAL(10,1)) AS VARCHAR) + ' KB'
-               END AS size,
-               FORMAT(uploaded_at, 'dd/MM/yyyy HH:mm') AS date,
-               upload_status AS status
+    limit = min(max(request.args.get('limit', HISTORY_LIMIT, type=int), 1), HISTORY_LIMIT)
+    before = request.args.get('before', '').strip()
+    try:
+        before = datetime.fromisoformat(before) if before else None
+    except ValueError:
+        return jsonify({'error': 'before deve ser data ISO 8601'}), 400
+    if before and before.tzinfo:
+        before = before.astimezone(timezone.utc).replace(tzinfo=None)  # uploaded_at é UTC sem fuso
+
+    # Colunas cruas (cobertas por IX_upload_files_client_date); a formatação é feita aqui.
+    # Paginação por chave: a próxima página começa antes do último uploaded_at devolvido
+    sql = """SELECT TOP (?)
+               original_filename, file_size_bytes, uploaded_at, upload_status
            FROM upload_files
-           WHERE client_id = ?
-           ORDER BY uploaded_at DESC""",
-        (client_id,)
-    )
-
-    if history is not None:
-        return jsonify(history)
-
-    return jsonify(demo_upload_history.get(client_id, []))
+           WHERE client_id = ?"""
+    params = [limit, client_id]
+    if before:
+        sql += " AND uploaded_at < ?"
+        params.append(before)
+    rows = query_db(sql + " ORDER BY uploaded_at DESC", params)
+
+    if rows is not None:
+        response = json_response([{
+            'name': row['original_filename'],
+            'size': format_file_size(row['file_size_bytes']),
+            'date': row['uploaded_at'].strftime('%d/%m/%Y %H:%M') if row['uploaded_at'] else None,
+            'status': row['upload_status']
+        } for row in rows])
+        if len(rows) == limit and rows[-1]['uploaded_at']:
+            response.headers['X-Next-Before'] = rows[-1]['uploaded_at'].isoformat()
+        return response
+
+    return json_response(list(islice(demo_upload_history.get(client_id, ()), limit)))
 
 
 @app.route('/api/dashboard', methods=['GET'])
@@ -421,7 +597,7 @@ def dashboard():
     result = query_db(
         "SELECT TOP 100 * FROM vw_upload_dashboard ORDER BY uploaded_at DESC"
     )
-    return jsonify(result or [])
+    return json_response(result or [])
 
 
 # ============================================================
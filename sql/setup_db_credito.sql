@@ -55,6 +55,18 @@ END
 ELSE PRINT '→ upload_files já existe';
 GO
 
+-- Índice de cobertura do histórico por cliente (criado também em bancos existentes)
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_upload_files_client_date'
+               AND object_id = OBJECT_ID('upload_files'))
+BEGIN
+    CREATE INDEX IX_upload_files_client_date
+        ON upload_files(client_id, uploaded_at DESC)
+        INCLUDE (original_filename, file_size_bytes, upload_status);
+    PRINT '✓ Índice IX_upload_files_client_date criado';
+END
+ELSE PRINT '→ IX_upload_files_client_date já existe';
+GO
+
 -- 3. Dados importados dos clientes (staging para o motor de crédito)
 IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'staging_data')
 BEGIN